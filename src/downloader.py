@@ -1,12 +1,63 @@
 import os
 import json
+import queue
+import atexit
 import asyncio
+import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+
 from datetime import datetime
 from dotenv import load_dotenv
 from telethon import TelegramClient
 from telethon.errors import FloodWaitError
 from tqdm import tqdm
 
+try:
+    import orjson  # Optional: faster progress serialization
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('timid')
+
+
+def setup_logging(level=logging.INFO):
+    """Route log records through a queue so emitting never blocks the event loop"""
+    if logger.handlers:
+        return
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', '%Y-%m-%d %H:%M:%S'))
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    # Drain queued records before the interpreter exits; the listener
+    # thread is a daemon and would otherwise drop the final lines
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+
+
+class CreditSemaphore:
+    """
+    Semaphore that refunds credits on a delay instead of on release,
+    shaping the request rate proactively (credits/refund_time per second)
+    so Telegram never answers with a multi-minute FloodWait.
+    """
+
+    def __init__(self, credits, refund_time):
+        self._semaphore = asyncio.Semaphore(credits)
+        self._refund_time = refund_time
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        asyncio.get_running_loop().call_later(
+            self._refund_time, self._semaphore.release
+        )
+
+
 class TelegramDownloader:
     """
     TIMID (Telegram IMage & vIDeo downloader)
@@ -27,56 +78,117 @@ class TelegramDownloader:
         os.makedirs(self.image_dir, exist_ok=True)
         os.makedirs(self.video_dir, exist_ok=True)
 
+        # Snapshot existing filenames once instead of a stat() per message
+        self._existing_images = {e.name for e in os.scandir(self.image_dir)}
+        self._existing_videos = {e.name for e in os.scandir(self.video_dir)}
+
+        # One line-buffered handle instead of open/write/close per error
+        os.makedirs('logs', exist_ok=True)
+        self._err_fp = open(
+            os.path.join('logs', 'error.log'), 'a', buffering=1, encoding='utf-8'
+        )
+
         # Initialize Telegram client
         self.client = TelegramClient(
             os.path.join('config', f'session_{self.channel_id}'),
             self.api_id,
             self.api_hash
         )
+        # Sleep through short flood waits instead of raising per task
+        self.client.flood_sleep_threshold = 60
         
-        # Progress management
+        # Progress management: resume point in JSON, downloaded ids in an
+        # append-only log
         self.image_progress_file = os.path.join('config', f'image_progress_{self.channel_id}.json')
         self.video_progress_file = os.path.join('config', f'video_progress_{self.channel_id}.json')
-        self.image_progress = self.load_progress(self.image_progress_file)
-        self.video_progress = self.load_progress(self.video_progress_file)
-        self.progress_bar = None
-        self.semaphore = asyncio.Semaphore(4)  # Limit concurrent downloads
+        self.image_log_file = os.path.join('config', f'image_downloaded_{self.channel_id}.log')
+        self.video_log_file = os.path.join('config', f'video_downloaded_{self.channel_id}.log')
+        self.image_progress = self.load_progress(self.image_progress_file, self.image_log_file)
+        self.video_progress = self.load_progress(self.video_progress_file, self.video_log_file)
+        self.semaphore = CreditSemaphore(40, 10)  # Rate-limit API requests
         self.retry_count = 3  # Maximum retry attempts
+        self.flush_interval = 50  # Flush progress to disk every N completions
+        self._pending_saves = {}  # progress_file -> completions since last flush
+        self._io_pool = ThreadPoolExecutor(max_workers=4)  # Off-loop file writes
+
+    def load_progress(self, progress_file, log_file):
+        """Load the resume point and the append-only log of downloaded ids"""
+        try:
+            with open(progress_file, 'rb') as f:
+                if orjson:
+                    data = orjson.loads(f.read())
+                else:
+                    data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
 
-    def load_progress(self, progress_file):
-        """Load download progress from file"""
         try:
-            with open(progress_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {'last_message_id': 0, 'downloaded_files': []}
+            with open(log_file, 'r') as f:
+                downloaded = set(f.read().split())
+        except FileNotFoundError:
+            downloaded = set()
+
+        log_fp = open(log_file, 'a', buffering=1)
+        # Migrate ids persisted by the old all-JSON layout into the log
+        for file_id in data.get('downloaded_files', []):
+            if file_id not in downloaded:
+                downloaded.add(file_id)
+                log_fp.write(file_id + '\n')
+
+        return {
+            'last_message_id': data.get('last_message_id', 0),
+            'downloaded_files': downloaded,
+            'log_fp': log_fp
+        }
 
     def save_progress(self, progress_file, progress_data, message_id, file_id):
-        """Save download progress to file"""
-        progress_data['last_message_id'] = message_id
+        """Record a completed download; the id is appended to the log at once
+        while the resume point is flushed every few completions"""
+        # Downloads complete out of order; never move the resume point back
+        progress_data['last_message_id'] = max(progress_data['last_message_id'], message_id)
         if file_id not in progress_data['downloaded_files']:
-            progress_data['downloaded_files'].append(file_id)
-            if len(progress_data['downloaded_files']) > 1000:
-                progress_data['downloaded_files'] = progress_data['downloaded_files'][-1000:]
-        with open(progress_file, 'w') as f:
-            json.dump(progress_data, f, indent=2)
+            progress_data['downloaded_files'].add(file_id)
+            progress_data['log_fp'].write(file_id + '\n')
+        self._pending_saves[progress_file] = self._pending_saves.get(progress_file, 0) + 1
+        if self._pending_saves[progress_file] >= self.flush_interval:
+            self._write_progress(progress_file, progress_data)
+
+    def _write_progress(self, progress_file, progress_data):
+        """Write the resume point to disk atomically via a temp file"""
+        tmp_file = progress_file + '.tmp'
+        data = {'last_message_id': progress_data['last_message_id']}
+        with open(tmp_file, 'wb') as f:
+            if orjson:
+                f.write(orjson.dumps(data))
+            else:
+                f.write(json.dumps(data).encode('utf-8'))
+        os.replace(tmp_file, progress_file)
+        self._pending_saves[progress_file] = 0
+
+    async def _flush_progress(self):
+        """Flush any unwritten progress to disk"""
+        if self._pending_saves.get(self.image_progress_file):
+            self._write_progress(self.image_progress_file, self.image_progress)
+        if self._pending_saves.get(self.video_progress_file):
+            self._write_progress(self.video_progress_file, self.video_progress)
 
     def log_error(self, error_msg):
         """Log error messages to file and console"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(os.path.join('logs', 'error.log'), 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] {error_msg}\n")
-        print(f"❌ {error_msg}")
+        self._err_fp.write(f"[{timestamp}] {error_msg}\n")
+        logger.error("❌ %s", error_msg)
 
     def log_info(self, message):
         """Log info messages to console"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[{timestamp}] ℹ️ {message}")
+        logger.info("ℹ️ %s", message)
 
-    def update_progress(self, current, total):
-        """Update progress bar during download"""
-        if self.progress_bar:
-            self.progress_bar.update(current - self.progress_bar.n)
+    async def _image_worker(self, image_queue):
+        """Pull messages off the queue and download their images until a sentinel"""
+        while True:
+            message = await image_queue.get()
+            if message is None:
+                break
+            await self.download_image(message)
 
     async def download_image(self, message):
         """Download image from Telegram message"""
@@ -88,11 +200,17 @@ class TelegramDownloader:
             self.log_info(f"Image already downloaded: {file_id}")
             return
 
-        filename = f"{message.date.strftime('%Y%m%d_%H%M%S')}_{message.id}.jpg"
+        # Format from the datetime fields directly; strftime pays for
+        # format parsing and locale lookups on every file
+        dt = message.date
+        filename = (
+            f"{dt.year:04d}{dt.month:02d}{dt.day:02d}_"
+            f"{dt.hour:02d}{dt.minute:02d}{dt.second:02d}_{message.id}.jpg"
+        )
         filepath = os.path.join(self.image_dir, filename)
 
         # Check if file already exists
-        if os.path.exists(filepath):
+        if filename in self._existing_images:
             self.log_info(f"File already exists: {filename}")
             return
 
@@ -103,11 +221,12 @@ class TelegramDownloader:
                     unit='B',
                     unit_scale=True,
                     desc=filename
-                ) as self.progress_bar:
+                ) as progress:
                     await message.download_media(
                         file=filepath,
-                        progress_callback=self.update_progress
+                        progress_callback=lambda c, t: progress.update(c - progress.n)
                     )
+                self._existing_images.add(filename)
                 self.save_progress(self.image_progress_file, self.image_progress, message.id, file_id)
                 self.log_info(f"✅ Image download completed: {filename}")
 
@@ -118,40 +237,91 @@ class TelegramDownloader:
         except Exception as e:
             self.log_error(f"Image download failed ({filename}): {str(e)}")
 
-    async def download_video_chunk(self, message, chunk_number, total_chunks):
-        """Download a specific chunk of video using iter_download"""
+    async def download_video_chunk(self, message, filepath, chunk_number, total_chunks):
+        """Download a specific byte range of a video into its offset of filepath"""
         try:
-            chunk_filename = f"chunk_{message.id}_{chunk_number}_{total_chunks}.part"
-            temp_dir = os.path.join(self.video_dir, "temp")
-            os.makedirs(temp_dir, exist_ok=True)
-            chunk_path = os.path.join(temp_dir, chunk_filename)
-            
             total_size = message.video.size
             chunk_size = total_size // total_chunks
-            
-            # Log file size information
-            self.log_info(f"Total file size: {total_size:,} bytes ({total_size/1024/1024:.2f}MB)")
-            self.log_info(f"Chunk size: {chunk_size:,} bytes ({chunk_size/1024/1024:.2f}MB)")
-            
-            with tqdm(
-                total=chunk_size,
-                unit='B',
-                unit_scale=True,
-                desc=f"Chunk {chunk_number + 1}/{total_chunks}"
-            ) as progress:
-                with open(chunk_path, 'wb') as f:
-                    async for chunk in message.client.iter_download(
-                        message.media
-                    ):
-                        f.write(chunk)
-                        progress.update(len(chunk))
-                        
-            return chunk_path
+            offset = chunk_number * chunk_size
+            # Last chunk picks up the division remainder
+            if chunk_number == total_chunks - 1:
+                this_len = total_size - offset
+            else:
+                this_len = chunk_size
+
+            async with self.semaphore:
+                # os.pwrite is missing on Windows; fall back to a per-task
+                # handle with seek+write (each task owns its byte range, so
+                # no locking is needed either way)
+                if hasattr(os, 'pwrite'):
+                    fd = os.open(filepath, os.O_WRONLY)
+
+                    def write_at(data, pos):
+                        os.pwrite(fd, data, pos)
+
+                    def close_file():
+                        os.close(fd)
+                else:
+                    fobj = open(filepath, 'r+b')
+
+                    def write_at(data, pos):
+                        fobj.seek(pos)
+                        fobj.write(data)
+
+                    def close_file():
+                        fobj.close()
+                try:
+                    with tqdm(
+                        total=this_len,
+                        unit='B',
+                        unit_scale=True,
+                        mininterval=0.25,
+                        miniters=1 << 20,
+                        desc=f"Chunk {chunk_number + 1}/{total_chunks}"
+                    ) as progress:
+                        # One reusable buffer per task instead of letting every
+                        # yielded chunk linger as its own heap allocation
+                        buf = memoryview(bytearray(512 * 1024))
+                        loop = asyncio.get_running_loop()
+                        remaining = this_len
+                        unreported = 0  # Bytes not yet pushed to the bar
+                        async for chunk in message.client.iter_download(
+                            message.media,
+                            offset=offset,
+                            request_size=512 * 1024,
+                            file_size=total_size
+                        ):
+                            n = min(len(chunk), remaining)
+                            buf[:n] = memoryview(chunk)[:n]
+                            # Write in the pool so the next network read isn't
+                            # blocked behind the disk
+                            await loop.run_in_executor(
+                                self._io_pool, write_at, buf[:n], offset
+                            )
+                            offset += n
+                            remaining -= n
+                            # Coalesce bar updates to ~1 MiB so the eight chunk
+                            # tasks don't serialize on tqdm's lock
+                            unreported += n
+                            if unreported >= 1 << 20:
+                                progress.update(unreported)
+                                unreported = 0
+                            if remaining <= 0:
+                                break
+                        if unreported:
+                            progress.update(unreported)
+                finally:
+                    close_file()
+
+            return True
+        except FloodWaitError:
+            # Let download_video's handler sleep out the penalty
+            raise
         except Exception as e:
             self.log_error(f"Chunk {chunk_number + 1} download failed: {str(e)}")
-            return None
+            return False
 
-    async def download_video(self, message):        
+    async def download_video(self, message):
         if not message.video:
             return
 
@@ -160,26 +330,47 @@ class TelegramDownloader:
             self.log_info(f"Video already downloaded: {file_id}")
             return
 
-        filename = f"{message.date.strftime('%Y%m%d_%H%M%S')}_{message.id}.mp4"
+        dt = message.date
+        filename = (
+            f"{dt.year:04d}{dt.month:02d}{dt.day:02d}_"
+            f"{dt.hour:02d}{dt.minute:02d}{dt.second:02d}_{message.id}.mp4"
+        )
         filepath = os.path.join(self.video_dir, filename)
 
-        if os.path.exists(filepath):
+        if filename in self._existing_videos:
             self.log_info(f"File already exists: {filename}")
             return
 
-        self.log_info(f"Total file size: ({message.video.size/1024/1024:.2f}MB)")
+        total_size = message.video.size
+        self.log_info(f"Total file size: ({total_size/1024/1024:.2f}MB)")
+        total_chunks = 8
+        part_path = filepath + '.part'
         try:
-            with tqdm(
-                total=message.video.size,
-                unit='B',
-                unit_scale=True,
-                desc=filename
-            ) as progress:
-                await message.download_media(
-                    file=filepath,
-                    progress_callback=lambda c, t: progress.update(c - progress.n)
-                )
+            # Pre-allocate so chunk tasks can write straight to their offsets
+            with open(part_path, 'wb') as f:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(f.fileno(), 0, total_size)
+                else:
+                    f.truncate(total_size)
+
+            # return_exceptions so every chunk task settles before a
+            # FloodWaitError is re-raised; otherwise siblings keep running
+            # through the penalty sleep
+            results = await asyncio.gather(*[
+                self.download_video_chunk(message, part_path, chunk_number, total_chunks)
+                for chunk_number in range(total_chunks)
+            ], return_exceptions=True)
+            for result in results:
+                if isinstance(result, FloodWaitError):
+                    os.remove(part_path)
+                    raise result
+            if not all(result is True for result in results):
+                self.log_error(f"Video download incomplete: {filename}")
+                os.remove(part_path)
+                return
 
+            os.replace(part_path, filepath)
+            self._existing_videos.add(filename)
             self.save_progress(self.video_progress_file, self.video_progress, message.id, file_id)
             self.log_info(f"✅ Video download completed: {filename}")
 
@@ -194,86 +385,72 @@ class TelegramDownloader:
     async def start(self):
         await self.client.start()
         self.log_info("Connected to Telegram")
-        
-        try:
-            channel = await self.client.get_entity(self.channel_id)
-            if not channel:
-                self.log_error("Channel not found")
-                return
 
+        try:
             self.log_info(f"Connected to channel {self.channel_id}")
 
-            # Total amount of messages
-            total_messages = await self.client.get_messages(
-                channel,
-                limit=1,
-                offset_date=None,
-                offset_id=0,
-                max_id=0,
-                min_id=0,
-                add_offset=0,
-                search=None,
-                filter=None
-            )
-            
-            if not total_messages:
+            # Total amount of messages in a single round trip; iter_messages
+            # resolves the integer channel id itself, no get_entity needed
+            total_messages = await self.client.get_messages(self.channel_id, limit=0)
+            total_count = total_messages.total
+
+            if not total_count:
                 self.log_error("No messages")
                 return
-                
-            total_count = total_messages[0].id
+
             self.log_info(f"Total messages: {total_count}")
             
-            # Image downloads (10 concurrent)
+            # Image downloads (10 concurrent workers fed by a bounded queue,
+            # so message pagination overlaps with the downloads)
             self.log_info("\n📸 Starting image downloads...")
-            active_image_downloads = set()
-            
+            image_queue = asyncio.Queue(maxsize=64)
+            image_workers = [
+                asyncio.create_task(self._image_worker(image_queue))
+                for _ in range(10)
+            ]
+
             async for message in self.client.iter_messages(
-                channel,
+                self.channel_id,
                 min_id=self.image_progress['last_message_id'],
+                offset_id=self.image_progress['last_message_id'],
                 reverse=True
             ):
                 if message.photo:
-                    self.log_info(f"Image Downloading: {message.id} / {total_count}")
-                    if len(active_image_downloads) >= 10:
-                        done, pending = await asyncio.wait(
-                            active_image_downloads, 
-                            return_when=asyncio.FIRST_COMPLETED
-                        )
-                        active_image_downloads = pending
-                    
-                    task = asyncio.create_task(self.download_image(message))
-                    active_image_downloads.add(task)
-            
-            if active_image_downloads:
-                await asyncio.wait(active_image_downloads)
+                    logger.debug("Image Downloading: %s / %s", message.id, total_count)
+                    await image_queue.put(message)
+
+            for _ in image_workers:
+                await image_queue.put(None)  # One stop sentinel per worker
+            await asyncio.gather(*image_workers)
             
-            # Video downloads (4 concurrent)
+            # Video downloads (4 concurrent, throttled by semaphore rather
+            # than re-waiting an active set on every completion)
             self.log_info("\n🎥 Starting video downloads...")
-            active_video_downloads = set()
-            
+            video_semaphore = asyncio.Semaphore(4)
+            video_tasks = []
+
+            async def run_video(message):
+                async with video_semaphore:
+                    await self.download_video(message)
+
             async for message in self.client.iter_messages(
-                channel,
+                self.channel_id,
                 min_id=self.video_progress['last_message_id'],
+                offset_id=self.video_progress['last_message_id'],
                 reverse=True
             ):
                 if message.video:
-                    self.log_info(f"Viedo Downloading: {message.id} / {total_count}")
-                    if len(active_video_downloads) >= 4:
-                        done, pending = await asyncio.wait(
-                            active_video_downloads, 
-                            return_when=asyncio.FIRST_COMPLETED
-                        )
-                        active_video_downloads = pending
-                    
-                    task = asyncio.create_task(self.download_video(message))
-                    active_video_downloads.add(task)
-            
-            if active_video_downloads:
-                await asyncio.wait(active_video_downloads)
+                    logger.debug("Video Downloading: %s / %s", message.id, total_count)
+                    video_tasks.append(asyncio.create_task(run_video(message)))
+
+            if video_tasks:
+                await asyncio.gather(*video_tasks)
 
         except Exception as e:
             self.log_error(f"Global error: {str(e)}")
         finally:
+            await self._flush_progress()
+            self._io_pool.shutdown(wait=True)
             await self.client.disconnect()
             self.log_info("✅ All downloads completed")
 
@@ -284,16 +461,27 @@ class TelegramDownloader:
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
+        await self._flush_progress()
         await self.client.disconnect()
+        self.image_progress['log_fp'].close()
+        self.video_progress['log_fp'].close()
+        self._err_fp.close()
 
 
 async def main():
     """Main execution function"""
+    setup_logging()
     downloader = TelegramDownloader()
     await downloader.start()
 
 
 if __name__ == '__main__':
+    try:
+        import uvloop  # Optional: faster event loop on Linux/macOS
+        uvloop.install()
+    except ImportError:
+        pass
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt: